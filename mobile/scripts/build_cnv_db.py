@@ -4,9 +4,10 @@ from __future__ import annotations
 
 import re
 import sqlite3
-from collections import defaultdict
+from collections import deque
+from itertools import chain, count, islice
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Deque, Dict, Iterable, Iterator, List, NamedTuple, Tuple
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -15,14 +16,53 @@ SOURCE_PATH = ASSETS_DIR / "新译本.txt"
 REFERENCE_DB = ASSETS_DIR / "bible_cuv.db"
 TARGET_DB = ASSETS_DIR / "bible_cnv.db"
 
+# Rows per multi-row INSERT: 5 bound parameters each stays within SQLite's
+# historical SQLITE_MAX_VARIABLE_NUMBER default of 999.
+INSERT_BATCH_ROWS = 199
+
 # Precompile regexes once for performance.
 CHAPTER_HEADING_RE = re.compile(r"^第([〇○零一二三四五六七八九十百千万两兩\d]+)(章|篇)")
-VERSE_SPLIT_RE = re.compile(r"(\d{1,3})")
+VERSE_NUMBER_RE = re.compile(r"\d{1,3}")
+
+
+_CHINESE_DIGITS = "零一二三四五六七八九"
+_TWO_VARIANTS = str.maketrans({"兩": "二", "两": "二"})
+
+
+def _render_chinese(number: int) -> str:
+    """Render 1..999 the way chapter headings spell it (e.g. 一百零五, 一百一十九)."""
+    hundreds, rest = divmod(number, 100)
+    tens, ones = divmod(rest, 10)
+    parts = []
+    if hundreds:
+        parts.append(_CHINESE_DIGITS[hundreds] + "百")
+        if rest and tens == 0:
+            parts.append("零")
+    if tens:
+        if hundreds or tens > 1:
+            parts.append(_CHINESE_DIGITS[tens])
+        parts.append("十")
+    if ones:
+        parts.append(_CHINESE_DIGITS[ones])
+    return "".join(parts)
+
+
+# Chapter numbers are bounded (Psalms tops out at 150), so the common headings
+# resolve with a single dict lookup instead of walking the numeral characters.
+CHAPTER_NUM_CACHE: Dict[str, int] = {}
+for _n in range(1, 201):
+    CHAPTER_NUM_CACHE[_render_chinese(_n)] = _n
+    CHAPTER_NUM_CACHE[str(_n)] = _n
+del _n
 
 
 def chinese_to_int(token: str) -> int:
     """Convert a Chinese numeral string to an integer."""
-    token = token.replace("兩", "二").replace("两", "二")
+    cached = CHAPTER_NUM_CACHE.get(token)
+    if cached is not None:
+        return cached
+
+    token = token.translate(_TWO_VARIANTS)
     if any(ch.isdigit() for ch in token):
         digits = "".join(ch for ch in token if ch.isdigit())
         return int(digits)
@@ -68,8 +108,9 @@ def chinese_to_int(token: str) -> int:
 
 def normalise_text(text: str) -> str:
     """Trim verse text and collapse ideographic spaces."""
-    cleaned = text.replace("\u3000", " ").strip()
-    return re.sub(r"\s+", " ", cleaned)
+    # str.split() already treats U+3000 as whitespace, so one C-level split/join
+    # both trims and collapses every run to a single ASCII space.
+    return " ".join(text.split())
 
 
 def should_accept_verse(current: int, candidate: int) -> bool:
@@ -89,48 +130,66 @@ def should_accept_verse(current: int, candidate: int) -> bool:
 
 def extract_verses(body: str) -> List[Tuple[int, str]]:
     """Extract (verse_number, text) pairs from a chapter body."""
-    parts = VERSE_SPLIT_RE.split(body)
     verses: List[Tuple[int, str]] = []
 
+    # Walk the digit runs directly; a verse's text runs from the end of its number
+    # to the start of the next digit run, whether or not that run is accepted.
     current_expected = 0
-    index = 1
-    while index < len(parts):
-        token = parts[index]
-        if token.isdigit():
-            verse_no = int(token)
-            previous = parts[index - 1] if index - 1 >= 0 else ""
-            following = parts[index + 1] if index + 1 < len(parts) else ""
-            prev_last = previous[-1] if previous else ""
-            next_first = following[0] if following else ""
-
-            if prev_last.isdigit():
-                index += 1
-                continue
-            if next_first and (next_first.isdigit() or next_first in ":：-—"):
-                index += 1
-                continue
+    prev_end = 0
+    matches = VERSE_NUMBER_RE.finditer(body)
+    match = next(matches, None)
+    while match is not None:
+        following = next(matches, None)
+        start, end = match.span()
+        text_end = following.start() if following is not None else len(body)
+        prev_last = body[start - 1] if start > prev_end else ""
+        next_first = body[end] if end < text_end else ""
+
+        # Skip digits glued to other digits or used in references such as 3:16 / 3-5.
+        is_reference = bool(next_first) and (next_first.isdigit() or next_first in ":：-—")
+        if not prev_last.isdigit() and not is_reference:
+            verse_no = int(match.group())
             if should_accept_verse(current_expected, verse_no):
-                verses.append((verse_no, normalise_text(following)))
+                verses.append((verse_no, normalise_text(body[end:text_end])))
                 current_expected = verse_no
-                index += 2
-                continue
-        index += 1
+
+        prev_end = end
+        match = following
 
     return verses
 
 
-def load_book_metadata() -> Dict[str, sqlite3.Row]:
-    """Load BibleID rows from the reference CUV database."""
+class BookInfo(NamedTuple):
+    """One BibleID row, in the column order of the BibleID table."""
+
+    sn: int
+    kind_sn: int
+    chapter_number: int
+    new_or_old: int
+    pinyin: str
+    short_name: str
+    full_name: str
+
+
+def load_book_metadata() -> Tuple[Dict[str, BookInfo], List[BookInfo]]:
+    """Load BibleID rows from the reference CUV database.
+
+    Returns the title -> row mapping (including aliases) together with the rows
+    themselves, sorted by SN for deterministic output.
+    """
     conn = sqlite3.connect(REFERENCE_DB)
-    conn.row_factory = sqlite3.Row
+    # Plain named tuples give cheap attribute access in the parsing hot loop,
+    # unlike sqlite3.Row's by-name column lookup.
+    conn.row_factory = lambda _cursor, row: BookInfo._make(row)
     cur = conn.cursor()
     cur.execute(
-        "SELECT SN, FullName, ShortName, NewOrOld, ChapterNumber FROM BibleID ORDER BY SN"
+        "SELECT SN, KindSN, ChapterNumber, NewOrOld, PinYin, ShortName, FullName"
+        " FROM BibleID ORDER BY SN"
     )
     rows = cur.fetchall()
     conn.close()
 
-    mapping = {row["FullName"]: row for row in rows}
+    mapping = {book.full_name: book for book in rows}
     # Provide aliases commonly used in 新译本标题。
     aliases = {
         "约翰一书": "约翰壹书",
@@ -141,78 +200,94 @@ def load_book_metadata() -> Dict[str, sqlite3.Row]:
     for alias, canonical in aliases.items():
         if canonical in mapping:
             mapping[alias] = mapping[canonical]
-    return mapping
+    return mapping, rows
 
 
-def parse_source(book_info: Dict[str, sqlite3.Row]) -> Dict[int, Dict[int, List[Tuple[int, str]]]]:
-    """Parse the source text into nested dictionaries keyed by book and chapter."""
+def parse_source(book_info: Dict[str, BookInfo]) -> Dict[Tuple[int, int], List[Tuple[int, str]]]:
+    """Parse the source text into a dictionary keyed by (book SN, chapter number)."""
     if not SOURCE_PATH.exists():
         raise FileNotFoundError(f"Missing source text: {SOURCE_PATH}")
 
-    text = SOURCE_PATH.read_bytes().decode("gb18030")
-    lines = text.splitlines()
+    data: Dict[Tuple[int, int], List[Tuple[int, str]]] = {}
 
-    started = False
-    current = None
-    data: Dict[int, Dict[int, List[Tuple[int, str]]]] = defaultdict(lambda: defaultdict(list))
+    # Resolve every title (aliases included) to its canonical book name up front so
+    # the per-line boundary check is one dict lookup plus a string compare.
+    canonical_names = {name: book.full_name for name, book in book_info.items()}
+    chapter_match = CHAPTER_HEADING_RE.match
 
-    index = 0
-    while index < len(lines):
-        stripped = lines[index].strip()
-        if not started:
+    # Stream the file line by line instead of holding the decoded text and a list of
+    # every line. Text-mode open() already decodes gb18030 incrementally in C, so a
+    # codecs.getreader() wrapper would only add overhead. A line that ends a chapter
+    # is pushed back onto ``lookahead`` so the outer loop can classify it.
+    with open(SOURCE_PATH, encoding="gb18030") as handle:
+        lines = (line.strip() for line in handle)
+        for stripped in lines:
             if stripped == "正文":
-                started = True
-            index += 1
-            continue
-
-        if not stripped:
-            index += 1
-            continue
-
-        if stripped in book_info:
-            current = book_info[stripped]
-            index += 1
-            continue
-
-        if current and stripped.startswith("第"):
-            chapter_lines: List[str] = [stripped]
-            index += 1
-            while index < len(lines):
-                candidate = lines[index].strip()
-                if not candidate:
-                    break
-                if candidate in book_info and book_info[candidate]["FullName"] != current["FullName"]:
-                    break
-                if candidate.startswith("第") and CHAPTER_HEADING_RE.match(candidate):
-                    # Reached next chapter within same book.
+                break
+
+        current = None
+        lookahead: Deque[str] = deque()
+        while True:
+            if lookahead:
+                stripped = lookahead.popleft()
+            else:
+                stripped = next(lines, None)
+                if stripped is None:
                     break
-                chapter_lines.append(candidate)
-                index += 1
-
-            chapter_text = "".join(chapter_lines)
-            match = CHAPTER_HEADING_RE.match(chapter_text)
-            if not match:
-                raise ValueError(f"Chapter heading malformed: {chapter_text[:50]}")
-            chapter_no = chinese_to_int(match.group(1))
-            body = chapter_text[match.end() :]
-            verses = extract_verses(body)
-            if not verses:
-                raise ValueError(
-                    f"No verses found for {current['FullName']} chapter {chapter_no}: {body[:100]}"
-                )
-            data[current["SN"]][chapter_no] = verses
-            continue
-
-        index += 1
+
+            if not stripped:
+                continue
+
+            if stripped in book_info:
+                current = book_info[stripped]
+                continue
+
+            if current and stripped[0] == "第":
+                current_full_name = current.full_name
+                chapter_lines: List[str] = [stripped]
+                for candidate in lines:
+                    if not candidate:
+                        break
+                    candidate_name = canonical_names.get(candidate)
+                    if candidate_name is not None and candidate_name != current_full_name:
+                        lookahead.append(candidate)
+                        break
+                    # Indexing is cheaper than a startswith() call, and candidate is non-empty here;
+                    # the first-character test keeps ordinary verse lines away from the regex.
+                    if candidate[0] == "第" and chapter_match(candidate):
+                        # Reached next chapter within same book.
+                        lookahead.append(candidate)
+                        break
+                    chapter_lines.append(candidate)
+
+                chapter_text = "".join(chapter_lines)
+                match = chapter_match(chapter_text)
+                if not match:
+                    raise ValueError(f"Chapter heading malformed: {chapter_text[:50]}")
+                chapter_no = chinese_to_int(match.group(1))
+                body = chapter_text[match.end() :]
+                verses = extract_verses(body)
+                if not verses:
+                    raise ValueError(
+                        f"No verses found for {current.full_name} chapter {chapter_no}: {body[:100]}"
+                    )
+                data[(current.sn, chapter_no)] = verses
 
     return data
 
 
-def create_database(metadata: Iterable[sqlite3.Row], verses: Dict[int, Dict[int, List[Tuple[int, str]]]]):
+def create_database(metadata: Iterable[BookInfo], verses: Dict[Tuple[int, int], List[Tuple[int, str]]]):
     if TARGET_DB.exists():
         TARGET_DB.unlink()
 
     conn = sqlite3.connect(TARGET_DB)
+    # The target is rebuilt from scratch on every run, so durability is not needed
+    # while loading; skip journaling and fsyncs to keep the bulk insert fast.
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-200000")
+    conn.execute("PRAGMA locking_mode=EXCLUSIVE")
     cur = conn.cursor()
 
     cur.executescript(
@@ -239,56 +314,47 @@ def create_database(metadata: Iterable[sqlite3.Row], verses: Dict[int, Dict[int,
         """
     )
 
-    cur.executemany(
-        "INSERT INTO BibleID (SN, KindSN, ChapterNumber, NewOrOld, PinYin, ShortName, FullName)"
-        " VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (
-            (
-                row["SN"],
-                row["KindSN"],
-                row["ChapterNumber"],
-                row["NewOrOld"],
-                row["PinYin"],
-                row["ShortName"],
-                row["FullName"],
-            )
-            for row in metadata
-        ),
-    )
-
-    insert_sql = (
-        "INSERT INTO Bible (ID, VolumeSN, ChapterSN, VerseSN, Lection, SoundBegin, SoundEnd)"
-        " VALUES (?, ?, ?, ?, ?, NULL, NULL)"
-    )
-    pk = 1
-    rows_to_insert: List[Tuple[int, int, int, int, str]] = []
-    for book_sn in sorted(verses):
-        chapters = verses[book_sn]
-        for chapter_sn in sorted(chapters):
-            for verse_sn, text in chapters[chapter_sn]:
-                rows_to_insert.append((pk, book_sn, chapter_sn, verse_sn, text))
-                pk += 1
-
-    cur.executemany(insert_sql, rows_to_insert)
-    conn.commit()
+    def _insert_sql(row_count: int) -> str:
+        return (
+            "INSERT INTO Bible (ID, VolumeSN, ChapterSN, VerseSN, Lection, SoundBegin, SoundEnd)"
+            " VALUES " + ", ".join(["(?, ?, ?, ?, ?, NULL, NULL)"] * row_count)
+        )
+
+    def _iter_rows() -> Iterator[Tuple[int, int, int, int, str]]:
+        # Yield rows lazily so they can be batched without an intermediate list.
+        rows = (
+            (book_sn, chapter_sn, verse_sn, text)
+            for (book_sn, chapter_sn), chapter_verses in sorted(verses.items())
+            for verse_sn, text in chapter_verses
+        )
+        for pk, (book_sn, chapter_sn, verse_sn, text) in zip(count(1), rows):
+            yield pk, book_sn, chapter_sn, verse_sn, text
+
+    # Load everything inside a single transaction so there is only one commit.
+    with conn:
+        cur.executemany(
+            "INSERT INTO BibleID (SN, KindSN, ChapterNumber, NewOrOld, PinYin, ShortName, FullName)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            metadata,
+        )
+        # Multi-row VALUES statements parse once per batch instead of binding row by row.
+        rows = _iter_rows()
+        batch_sql = _insert_sql(INSERT_BATCH_ROWS)
+        while True:
+            batch = list(islice(rows, INSERT_BATCH_ROWS))
+            if not batch:
+                break
+            sql = batch_sql if len(batch) == INSERT_BATCH_ROWS else _insert_sql(len(batch))
+            cur.execute(sql, list(chain.from_iterable(batch)))
     conn.close()
 
 
 def main():
-    book_info = load_book_metadata()
+    book_info, metadata_rows = load_book_metadata()
     parsed = parse_source(book_info)
-
-    # Sort metadata rows for deterministic output.
-    conn = sqlite3.connect(REFERENCE_DB)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM BibleID ORDER BY SN")
-    metadata_rows = cur.fetchall()
-    conn.close()
-
     create_database(metadata_rows, parsed)
 
-    total_verses = sum(len(chapter_verses) for book in parsed.values() for chapter_verses in book.values())
+    total_verses = sum(len(chapter_verses) for chapter_verses in parsed.values())
     print(f"Created {TARGET_DB.relative_to(PROJECT_ROOT)} with {total_verses} verses.")
 
 
@@ -1,4 +1,14 @@
+# 依赖: pip install pillow
+# 推荐安装 Pillow-SIMD 以加速缩放/编码 (与 pillow 互斥，需先卸载):
+#   pip uninstall pillow && pip install pillow-simd
+import argparse
+import json
 import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
 from PIL import Image
 from pathlib import Path
 
@@ -14,67 +24,277 @@ QUALITY = 80
 
 # 最大宽度 (如果图片太宽，自动缩小，0 表示不改变尺寸)
 MAX_WIDTH = 1200 
+
+# 缩放滤镜 (缩小到 MAX_WIDTH 后再经 WebP 有损压缩，BILINEAR 与 LANCZOS 肉眼几乎无差别但快得多)
+RESAMPLE = Image.Resampling.BILINEAR
+
+# 如果系统安装了 libwebp 的 cwebp 命令 (PATH 中可找到)，JPEG/PNG/TIFF 直接交给它编码，
+# 跳过 Pillow 的解码/编码；找不到时自动回退到 Pillow
+CWEBP = shutil.which("cwebp")
+CWEBP_FORMATS = ('.jpg', '.jpeg', '.png', '.tiff')
+# cwebp 的 -mt 多线程编码；多进程并行时会与其他进程争抢 CPU，由 init_worker 按并行度设置
+CWEBP_MULTITHREAD = False
 # ----------------
 
-def optimize_images():
+# 输出目录中记录上次所用压缩参数的文件；参数变化时所有输出都视为过期
+SETTINGS_FILE = ".optimize_settings.json"
+
+
+@dataclass
+class Result:
+    """单张图片的处理结果，由子进程返回给主进程统一打印。"""
+    path: str
+    output_path: str
+    original: int
+    new: int = 0
+    error: Optional[str] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def init_worker(quality, max_width, cwebp_multithread=False):
+    """同步压缩参数 (spawn 模式下子进程不会继承主进程修改过的全局变量)。"""
+    global QUALITY, MAX_WIDTH, CWEBP_MULTITHREAD
+    QUALITY = quality
+    MAX_WIDTH = max_width
+    CWEBP_MULTITHREAD = cwebp_multithread
+
+
+def image_width(path):
+    """只读取文件头获取宽度，不解码像素。"""
+    with Image.open(path) as img:
+        return img.width
+
+
+def link_or_copy(input_path, output_path):
+    """把源文件硬链接到输出路径 (跨分区等不支持硬链接时改为复制)。"""
+    try:
+        os.link(input_path, output_path)
+    except OSError:
+        shutil.copy2(input_path, output_path)
+
+
+def encode_with_cwebp(input_path, output_path):
+    """用 cwebp 直接把原图压缩为 WebP (必要时缩放到 MAX_WIDTH)。"""
+    cmd = [CWEBP, "-quiet", "-q", str(QUALITY)]
+    if CWEBP_MULTITHREAD:
+        cmd.append("-mt")
+    # 小图不放大
+    if MAX_WIDTH > 0 and image_width(input_path) > MAX_WIDTH:
+        cmd += ["-resize", str(MAX_WIDTH), "0"]
+    cmd += [input_path, "-o", output_path]
+
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        message = result.stderr.decode(errors="replace").strip()
+        raise RuntimeError(message or f"cwebp 退出码 {result.returncode}")
+
+
+def encode_with_pillow(input_path, output_path):
+    """用 Pillow 解码、缩放并保存为 WebP。"""
+    with Image.open(input_path) as img:
+        # 0. JPEG 可让解码器直接按 1/2、1/4 比例缩小解码，跳过大图的大部分解码开销
+        if MAX_WIDTH > 0 and img.format == "JPEG" and img.width > MAX_WIDTH * 2:
+            img.draft("RGB", (MAX_WIDTH * 2, MAX_WIDTH * 2))
+
+        # 1. 转换颜色模式 (PNG 如果有透明度需保留 RGBA，JPG 转 RGB)
+        if img.mode in ("RGBA", "P"):
+            img = img.convert("RGBA")
+        else:
+            img = img.convert("RGB")
+
+        # 2. 调整尺寸 (如果设置了 MAX_WIDTH)
+        if MAX_WIDTH > 0 and img.width > MAX_WIDTH:
+            ratio = MAX_WIDTH / img.width
+            new_height = int(img.height * ratio)
+            img = img.resize((MAX_WIDTH, new_height), RESAMPLE)
+
+        # 3. 保存为 WebP
+        img.save(output_path, 'webp', quality=QUALITY, optimize=True)
+
+
+def process_one(task):
+    """压缩单张图片，返回 Result。子进程不直接打印，避免多个进程的输出交错。"""
+    input_path, output_path, original_size = task
+    # 先写到同目录的临时文件再 os.replace 到输出路径。输出可能是上次运行时硬链接到源文件的，
+    # 直接原地写入会连源文件一起改掉；replace 只替换目录项，源文件不受影响
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        # 已经是 WebP 且不需要缩小: 重新编码只会带来二次压缩损失，直接链接/复制原文件
+        if input_path.lower().endswith(".webp") and (MAX_WIDTH <= 0 or image_width(input_path) <= MAX_WIDTH):
+            # 上次运行已把输出链接到源文件: 无需再做。否则 temp_path 会成为同一 inode 的又一个链接，
+            # 而同一文件的两个链接之间 rename 什么也不做，临时文件会残留在输出目录
+            if os.path.exists(output_path) and os.path.samefile(input_path, output_path):
+                return Result(input_path, output_path, original_size, original_size)
+            link_or_copy(input_path, temp_path)
+        elif CWEBP and input_path.lower().endswith(CWEBP_FORMATS):
+            try:
+                encode_with_cwebp(input_path, temp_path)
+            except RuntimeError:
+                # cwebp 读不了的文件 (如 CMYK JPEG、未编译 libtiff 时的 TIFF) 交给 Pillow 再试一次
+                encode_with_pillow(input_path, temp_path)
+        else:
+            encode_with_pillow(input_path, temp_path)
+
+        os.replace(temp_path, output_path)
+        # 保险: 若 temp_path 与 output_path 恰为同一文件的两个链接，replace 不会删除 temp_path
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        return Result(input_path, output_path, original_size, os.path.getsize(output_path))
+    except Exception as e:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        return Result(input_path, output_path, original_size, error=str(e))
+
+
+def scan_images(directory, relative_path="", exclude_dir=None):
+    """递归遍历目录，产出 (DirEntry, 相对子目录)。DirEntry.stat() 会缓存结果，避免重复系统调用。
+
+    exclude_dir 为已解析的绝对路径，遍历时跳过该目录 (输出目录位于输入目录内时，避免把输出当作输入)。
+    """
+    try:
+        entries = os.scandir(directory)
+    except OSError as e:
+        # 与 os.walk 一致: 无权限等无法读取的目录直接跳过，不中断整个任务
+        print(f"[跳过] 无法读取目录 {directory}: {e}")
+        return
+
+    with entries:
+        # 按文件名排序，保证输出顺序和同名冲突时保留哪个文件都是确定的
+        for entry in sorted(entries, key=lambda e: e.name):
+            # 不跟随目录符号链接 (与 os.walk 默认行为一致)，避免指向上级目录时无限递归
+            if entry.is_dir(follow_symlinks=False):
+                if exclude_dir is not None and os.path.realpath(entry.path) == exclude_dir:
+                    continue
+                yield from scan_images(entry.path, os.path.join(relative_path, entry.name), exclude_dir)
+            elif entry.is_file():
+                yield entry, relative_path
+
+
+def load_settings(path):
+    """读取上次运行记录的压缩参数，不存在或无法解析时返回 None。"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def optimize_images(input_dir=INPUT_DIR, output_dir=OUTPUT_DIR, jobs=None, force=False):
     # 创建输出目录
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    # 增量构建只在压缩参数不变时成立: 参数变化 (或没有记录) 时重新处理全部图片
+    settings = {"quality": QUALITY, "max_width": MAX_WIDTH}
+    settings_path = os.path.join(output_dir, SETTINGS_FILE)
+    previous_settings = load_settings(settings_path)
+    if not force and previous_settings != settings:
+        if previous_settings is not None:
+            print(f"[提示] 压缩参数已变化 ({previous_settings} -> {settings})，重新处理全部图片")
+        force = True
 
     # 支持的格式
-    supported_formats = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
-    
+    supported_formats = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+
+    # 先遍历目录收集任务，再交给进程池并行处理 (每张图片互不依赖，且编码是 CPU 密集型)
+    tasks = []
+    skipped = 0
+    created_dirs = set()
+    # 输出路径 -> 源文件，用于发现 photo.png 与 photo.webp 这类映射到同一输出的文件
+    output_sources = {}
+    for entry, relative_path in scan_images(input_dir, exclude_dir=os.path.realpath(output_dir)):
+        if not entry.name.lower().endswith(supported_formats):
+            continue
+
+        # 保持子目录结构，输出文件名改为 .webp
+        target_dir = os.path.join(output_dir, relative_path) if relative_path else output_dir
+        file_name_without_ext = os.path.splitext(entry.name)[0]
+        output_path = os.path.join(target_dir, file_name_without_ext + ".webp")
+        input_stat = entry.stat()
+
+        # 多个源文件对应同一输出时只处理第一个，避免并行进程争写同一个文件
+        if output_path in output_sources:
+            print(f"[冲突] {entry.path} 与 {output_sources[output_path]} 的输出同为 {output_path}，已跳过")
+            continue
+        output_sources[output_path] = entry.path
+
+        # 增量构建: 输出已存在且不早于源文件时跳过，重复运行只需 stat 调用
+        if not force:
+            try:
+                if os.stat(output_path).st_mtime >= input_stat.st_mtime:
+                    skipped += 1
+                    continue
+            except FileNotFoundError:
+                pass
+
+        # 每个子目录只创建一次
+        if target_dir not in created_dirs:
+            Path(target_dir).mkdir(parents=True, exist_ok=True)
+            created_dirs.add(target_dir)
+
+        tasks.append((entry.path, output_path, input_stat.st_size))
+
     count = 0
     saved_space = 0
 
-    for root, dirs, files in os.walk(INPUT_DIR):
-        # 保持子目录结构
-        relative_path = os.path.relpath(root, INPUT_DIR)
-        target_dir = os.path.join(OUTPUT_DIR, relative_path)
-        if not os.path.exists(target_dir):
-            os.makedirs(target_dir)
-
-        for file in files:
-            if file.lower().endswith(supported_formats):
-                input_path = os.path.join(root, file)
-                # 输出文件名改为 .webp
-                file_name_without_ext = os.path.splitext(file)[0]
-                output_path = os.path.join(target_dir, file_name_without_ext + ".webp")
-
-                try:
-                    with Image.open(input_path) as img:
-                        # 1. 转换颜色模式 (PNG 如果有透明度需保留 RGBA，JPG 转 RGB)
-                        if img.mode in ("RGBA", "P"):
-                            img = img.convert("RGBA")
-                        else:
-                            img = img.convert("RGB")
-
-                        # 2. 调整尺寸 (如果设置了 MAX_WIDTH)
-                        if MAX_WIDTH > 0 and img.width > MAX_WIDTH:
-                            ratio = MAX_WIDTH / img.width
-                            new_height = int(img.height * ratio)
-                            img = img.resize((MAX_WIDTH, new_height), Image.Resampling.LANCZOS)
-
-                        # 3. 保存为 WebP
-                        img.save(output_path, 'webp', quality=QUALITY, optimize=True)
-
-                        # 统计
-                        original_size = os.path.getsize(input_path)
-                        new_size = os.path.getsize(output_path)
-                        saved = original_size - new_size
-                        saved_space += saved
-                        
-                        print(f"[成功] {file} -> {os.path.basename(output_path)}")
-                        print(f"       大小: {original_size/1024:.1f}KB -> {new_size/1024:.1f}KB (减少 {saved/original_size*100:.1f}%)")
-                        count += 1
-
-                except Exception as e:
-                    print(f"[失败] {file}: {e}")
+    # 只有单进程时才让 cwebp 自己多线程编码，避免 CPU 超额订阅
+    worker_count = jobs or os.cpu_count() or 1
+
+    # jobs 为 None 时使用 ProcessPoolExecutor 自己的默认值 (Windows 上最多 61 个进程)
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_worker,
+        initargs=(QUALITY, MAX_WIDTH, worker_count == 1),
+    ) as executor:
+        # map 按提交顺序返回结果，输出顺序与串行版本一致且可复现
+        for result in executor.map(process_one, tasks, chunksize=8):
+            file = os.path.basename(result.path)
+            if not result.ok:
+                print(f"[失败] {file}: {result.error}")
+                # 强制重建时失败: 删除按旧参数生成的输出，否则记录新参数后它会被 mtime 检查当作最新而跳过
+                if force and os.path.lexists(result.output_path):
+                    os.remove(result.output_path)
+                continue
+
+            # 统计
+            saved = result.original - result.new
+            saved_space += saved
+
+            print(f"[成功] {file} -> {os.path.basename(result.output_path)}")
+            print(f"       大小: {result.original/1024:.1f}KB -> {result.new/1024:.1f}KB (减少 {saved/result.original*100:.1f}%)")
+            count += 1
+
+    # 全部处理完后再记录参数；中途中断时旧记录保留，下次仍会全部重新处理
+    with open(settings_path, "w", encoding="utf-8") as f:
+        json.dump(settings, f)
 
     print("-" * 30)
-    print(f"处理完成！共转换 {count} 张图片。")
+    print(f"处理完成！共转换 {count} 张图片，跳过 {skipped} 张未修改的图片。")
     print(f"总共节省空间: {saved_space / 1024 / 1024:.2f} MB")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="批量把图片压缩为 WebP")
+    parser.add_argument("--input", default=INPUT_DIR, help=f"原始图片目录 (默认 {INPUT_DIR})")
+    parser.add_argument("--output", default=OUTPUT_DIR, help=f"输出目录 (默认 {OUTPUT_DIR})")
+    parser.add_argument("--quality", type=int, default=QUALITY, help=f"压缩质量 0-100 (默认 {QUALITY})")
+    parser.add_argument("--max-width", type=int, default=MAX_WIDTH, help=f"最大宽度，0 表示不缩放 (默认 {MAX_WIDTH})")
+    parser.add_argument("--jobs", type=int, default=None, help="并行进程数 (默认 CPU 核数)")
+    parser.add_argument("--force", action="store_true", help="忽略增量构建，重新处理全部图片")
+    args = parser.parse_args()
+
+    if not 0 <= args.quality <= 100:
+        parser.error("--quality 必须在 0-100 之间")
+    if args.max_width < 0:
+        parser.error("--max-width 不能为负数")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs 至少为 1")
+    return args
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    init_worker(args.quality, args.max_width)
     print("开始优化图片...")
-    optimize_images()
\ No newline at end of file
+    optimize_images(args.input, args.output, args.jobs, args.force)